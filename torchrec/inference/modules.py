@@ -34,6 +34,23 @@ def quantize_embeddings(
     )
 
 
+def quantize_dense(
+    module: nn.Module, dtype: torch.dtype = torch.qint8, inplace: bool = False
+) -> nn.Module:
+    """
+    Dynamically quantizes the nn.Linear layers of a module (e.g. the DenseArch and
+    OverArch MLPs of DLRM) for CPU inference. Weights are stored in `dtype`
+    (torch.qint8 or torch.float16) and, for torch.qint8, activations are quantized on
+    the fly so the matmuls run as int8 FBGEMM GEMMs.
+    """
+    return quant.quantize_dynamic(
+        module,
+        qconfig_spec={nn.Linear},
+        dtype=dtype,
+        inplace=inplace,
+    )
+
+
 class PredictFactory(abc.ABC):
     """
     Creates a model (with already learned weights) to be used inference time.
@@ -10,7 +10,8 @@ from typing import Dict
 
 import torch
 import torch.nn as nn
-from torchrec.inference.modules import PredictModule
+import torch.quantization as quant
+from torchrec.inference.modules import PredictModule, quantize_dense
 
 
 class TestModule(nn.Module):
@@ -41,3 +42,18 @@ class PredictModulesTest(unittest.TestCase):
             module_state_dict.values(), predict_module_state_dict.values()
         ):
             self.assertTrue(torch.equal(tensor0, tensor1))
+
+    def test_quantize_dense(self) -> None:
+        torch.manual_seed(0)
+        module = nn.Sequential(nn.Linear(10, 4), nn.ReLU(), nn.Linear(4, 1))
+        quantized_module = quantize_dense(module, dtype=torch.qint8, inplace=False)
+
+        dynamic_linear = quant.get_default_dynamic_quant_module_mappings()[nn.Linear]
+        self.assertIsInstance(module[0], nn.Linear)
+        self.assertIsInstance(quantized_module[0], dynamic_linear)
+        self.assertIsInstance(quantized_module[2], dynamic_linear)
+
+        input = torch.rand((3, 10))
+        self.assertTrue(
+            torch.allclose(quantized_module(input), module(input), atol=5e-2)
+        )
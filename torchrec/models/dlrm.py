@@ -5,10 +5,12 @@
 # This source code is licensed under the BSD-style license found in the
 # LICENSE file in the root directory of this source tree.
 
+import itertools
 from typing import List, Optional
 
 import torch
 from torch import nn
+from torch.fx import wrap
 from torchrec.modules.embedding_modules import EmbeddingBagCollection
 from torchrec.modules.mlp import MLP
 from torchrec.sparse.jagged_tensor import (
@@ -32,20 +34,41 @@ num_features: number of dense features
 """
 
 
-def choose(n: int, k: int) -> int:
+try:
+    from math import comb as choose
+except ImportError:
+
+    def choose(n: int, k: int) -> int:
+        """
+        Simple implementation of math.comb for python 3.7 compatibility
+        """
+        if 0 <= k <= n:
+            ntok = 1
+            ktok = 1
+            for t in range(1, min(k, n - k) + 1):
+                ntok *= n
+                ktok *= t
+                n -= 1
+            return ntok // ktok
+        else:
+            return 0
+
+
+# pyre-ignore[56]: Pyre was not able to infer the type of the decorator `torch.fx.wrap`.
+@wrap
+def _get_sparse_values(
+    sparse_features: KeyedTensor, sparse_feature_names: List[str]
+) -> torch.Tensor:
     """
-    Simple implementation of math.comb for python 3.7 compatibility
+    Returns the pooled embeddings of `sparse_feature_names`, in that order, as
+    B X (F * D). This is the KeyedTensor values as is when its keys already follow
+    `sparse_feature_names`, otherwise (e.g. the rank-grouped output of a sharded
+    EmbeddingBagCollection, or extra keys) the features are gathered by key.
     """
-    if 0 <= k <= n:
-        ntok = 1
-        ktok = 1
-        for t in range(1, min(k, n - k) + 1):
-            ntok *= n
-            ktok *= t
-            n -= 1
-        return ntok // ktok
-    else:
-        return 0
+    if sparse_features.keys() == sparse_feature_names:
+        return sparse_features.values()
+    sparse = sparse_features.to_dict()
+    return torch.cat([sparse[name] for name in sparse_feature_names], dim=1)
 
 
 class SparseArch(nn.Module):
@@ -106,6 +129,8 @@ class DenseArch(nn.Module):
         in_features: int - size of the input.
         layer_sizes: List[int] - list of layer sizes.
         device: (Optional[torch.device]).
+        fuse_activation: bool - apply ReLU in place on each Linear output, saving an
+            allocation and a memory pass per layer.
 
     Call Args:
         features: torch.Tensor  - size B X num_features
@@ -125,10 +150,15 @@ class DenseArch(nn.Module):
         in_features: int,
         layer_sizes: List[int],
         device: Optional[torch.device] = None,
+        fuse_activation: bool = False,
     ) -> None:
         super().__init__()
         self.model: nn.Module = MLP(
-            in_features, layer_sizes, bias=True, activation="relu", device=device
+            in_features,
+            layer_sizes,
+            bias=True,
+            activation=torch.relu_ if fuse_activation else "relu",
+            device=device,
         )
 
     def forward(self, features: torch.Tensor) -> torch.Tensor:
@@ -146,8 +176,18 @@ class InteractionArch(nn.Module):
     dimensionality of the sparse_features so that the dot products between them can be
     computed.
 
+    NOTE: When the keys of sparse_features are exactly sparse_feature_names, in order
+    (as produced by an unsharded EmbeddingBagCollection), the pooled embeddings are
+    used without copying. Any other key order, or extra keys, falls back to gathering
+    the features by name.
+
     Constructor Args:
         sparse_feature_names: List[str] - size F
+        compute_dtype: Optional[torch.dtype] - dtype the pairwise dot products are
+            computed in (e.g. torch.bfloat16 to run the bmm on tensor cores). The
+            interactions are cast back to the dtype of dense_features. Defaults to
+            computing in the input dtype.
+        device: (Optional[torch.device]).
 
     Call Args:
         dense_features: torch.Tensor  - size B X D
@@ -175,13 +215,34 @@ class InteractionArch(nn.Module):
         concat_dense = inter_arch(dense_features, sparse_features)
     """
 
-    def __init__(self, sparse_feature_names: List[str]) -> None:
+    def __init__(
+        self,
+        sparse_feature_names: List[str],
+        compute_dtype: Optional[torch.dtype] = None,
+        device: Optional[torch.device] = None,
+    ) -> None:
         super().__init__()
+        if len(set(sparse_feature_names)) != len(sparse_feature_names):
+            raise ValueError(
+                f"sparse_feature_names ({sparse_feature_names}) must be unique."
+            )
         self.F: int = len(sparse_feature_names)
-        self.triu_indices: torch.Tensor = torch.triu_indices(
-            self.F + 1, self.F + 1, offset=1
+        self.register_buffer(
+            "triu_indices",
+            torch.triu_indices(self.F + 1, self.F + 1, offset=1, device=device).to(
+                torch.int32
+            ),
+            persistent=False,
+        )
+        # flattened (row * (F + 1) + col) positions of the strict upper triangle, so
+        # the interactions can be gathered from a B X (F + 1)^2 view in one pass.
+        self.register_buffer(
+            "triu_flat",
+            self.triu_indices[0] * (self.F + 1) + self.triu_indices[1],
+            persistent=False,
         )
         self.sparse_feature_names = sparse_feature_names
+        self._compute_dtype = compute_dtype
 
     def forward(
         self, dense_features: torch.Tensor, sparse_features: KeyedTensor
@@ -190,20 +251,38 @@ class InteractionArch(nn.Module):
             return dense_features
         (B, D) = dense_features.shape
 
-        sparse = sparse_features.to_dict()
-        sparse_values = []
-        for name in self.sparse_feature_names:
-            sparse_values.append(sparse[name])
-
-        sparse_values = torch.cat(sparse_values, dim=1).reshape(B, self.F, D)
-        combined_values = torch.cat((dense_features.unsqueeze(1), sparse_values), dim=1)
+        sparse_values = _get_sparse_values(sparse_features, self.sparse_feature_names)
+        if self.F == 1:
+            # the only interaction is dense/sparse, a single mul + sum replaces the
+            # bmm and triu gather
+            dense_values = dense_features
+            if self._compute_dtype is not None:
+                dense_values = dense_values.to(self._compute_dtype)
+                sparse_values = sparse_values.to(self._compute_dtype)
+            dot = torch.sum(dense_values * sparse_values, dim=1, keepdim=True)
+            if self._compute_dtype is not None:
+                dot = dot.to(dense_features.dtype)
+            return torch.cat((dense_features, dot), dim=1)
+
+        # NOTE: combined_values is deliberately not cached on the module. Copying into
+        # a persistent buffer in place would chain autograd history across steps and
+        # ties the module to one (B, D), which symbolic tracing cannot express.
+        # Concatenating the flat B X D and B X (F * D) rows lays out B X (F + 1) X D
+        # directly, so no unsqueeze or per-tensor reshape is needed before the cat.
+        combined_values = torch.cat((dense_features, sparse_values), dim=1).view(
+            B, self.F + 1, D
+        )
+        if self._compute_dtype is not None:
+            combined_values = combined_values.to(self._compute_dtype)
 
         # dense/sparse + sparse/sparse interaction
         # size B X (F + F choose 2)
         interactions = torch.bmm(
             combined_values, torch.transpose(combined_values, 1, 2)
         )
-        interactions_flat = interactions[:, self.triu_indices[0], self.triu_indices[1]]
+        interactions_flat = interactions.reshape(B, -1).index_select(1, self.triu_flat)
+        if self._compute_dtype is not None:
+            interactions_flat = interactions_flat.to(dense_features.dtype)
 
         return torch.cat((dense_features, interactions_flat), dim=1)
 
@@ -216,6 +295,7 @@ class OverArch(nn.Module):
         in_features: int
         layer_sizes: list[int]
         device: (Optional[torch.device]).
+        fuse_activation: bool - apply ReLU in place on each hidden Linear output.
 
     Call Args:
         features: torch.Tensor
@@ -235,6 +315,7 @@ class OverArch(nn.Module):
         in_features: int,
         layer_sizes: List[int],
         device: Optional[torch.device] = None,
+        fuse_activation: bool = False,
     ) -> None:
         super().__init__()
         if len(layer_sizes) <= 1:
@@ -244,7 +325,7 @@ class OverArch(nn.Module):
                 in_features,
                 layer_sizes[:-1],
                 bias=True,
-                activation="relu",
+                activation=torch.relu_ if fuse_activation else "relu",
                 device=device,
             ),
             nn.Linear(layer_sizes[-2], layer_sizes[-1], bias=True, device=device),
@@ -275,6 +356,10 @@ class DLRM(nn.Module):
             output dimension of the InteractionArch should not be manually specified
             here.
         dense_device: (Optional[torch.device]).
+        interaction_dtype (Optional[torch.dtype]): dtype the InteractionArch computes
+            the pairwise dot products in. Defaults to the dtype of the inputs.
+        fuse_activation (bool): apply ReLU in place on the Linear outputs of the
+            DenseArch and OverArch MLPs.
 
     Call Args:
         dense_features: torch.Tensor,
@@ -332,31 +417,33 @@ class DLRM(nn.Module):
         dense_arch_layer_sizes: List[int],
         over_arch_layer_sizes: List[int],
         dense_device: Optional[torch.device] = None,
+        interaction_dtype: Optional[torch.dtype] = None,
+        fuse_activation: bool = False,
     ) -> None:
         super().__init__()
         assert (
             len(embedding_bag_collection.embedding_bag_configs) > 0
         ), "At least one embedding bag is required"
-        for i in range(1, len(embedding_bag_collection.embedding_bag_configs)):
-            conf_prev = embedding_bag_collection.embedding_bag_configs[i - 1]
-            conf = embedding_bag_collection.embedding_bag_configs[i]
-            assert (
-                conf_prev.embedding_dim == conf.embedding_dim
-            ), "All EmbeddingBagConfigs must have the same dimension"
-        embedding_dim: int = embedding_bag_collection.embedding_bag_configs[
-            0
-        ].embedding_dim
+        embedding_dims = {
+            conf.embedding_dim
+            for conf in embedding_bag_collection.embedding_bag_configs
+        }
+        assert (
+            len(embedding_dims) == 1
+        ), "All EmbeddingBagConfigs must have the same dimension"
+        embedding_dim: int = next(iter(embedding_dims))
         if dense_arch_layer_sizes[-1] != embedding_dim:
             raise ValueError(
                 f"embedding_bag_collection dimension ({embedding_dim}) and final dense "
                 "arch layer size ({dense_arch_layer_sizes[-1]}) must match."
             )
 
-        feature_names = [
-            name
-            for conf in embedding_bag_collection.embedding_bag_configs
-            for name in conf.feature_names
-        ]
+        feature_names = list(
+            itertools.chain.from_iterable(
+                conf.feature_names
+                for conf in embedding_bag_collection.embedding_bag_configs
+            )
+        )
         num_feature_names = len(feature_names)
 
         over_in_features = (
@@ -368,12 +455,18 @@ class DLRM(nn.Module):
             in_features=dense_in_features,
             layer_sizes=dense_arch_layer_sizes,
             device=dense_device,
+            fuse_activation=fuse_activation,
+        )
+        self.inter_arch = InteractionArch(
+            sparse_feature_names=feature_names,
+            compute_dtype=interaction_dtype,
+            device=dense_device,
         )
-        self.inter_arch = InteractionArch(sparse_feature_names=feature_names)
         self.over_arch = OverArch(
             in_features=over_in_features,
             layer_sizes=over_arch_layer_sizes,
             device=dense_device,
+            fuse_activation=fuse_activation,
         )
 
     def forward(
@@ -381,10 +474,143 @@ class DLRM(nn.Module):
         dense_features: torch.Tensor,
         sparse_features: KeyedJaggedTensor,
     ) -> torch.Tensor:
-        embedded_dense = self.dense_arch(dense_features)
         embedded_sparse = self.sparse_arch(sparse_features)
+        return self._dense_forward(dense_features, embedded_sparse)
+
+    def _dense_forward(
+        self,
+        dense_features: torch.Tensor,
+        embedded_sparse: KeyedTensor,
+    ) -> torch.Tensor:
+        embedded_dense = self.dense_arch(dense_features)
         concatenated_dense = self.inter_arch(
             dense_features=embedded_dense, sparse_features=embedded_sparse
         )
         logits = self.over_arch(concatenated_dense)
         return logits
+
+    def capture_inference_graph(
+        self,
+        dense_features: torch.Tensor,
+        sparse_features: KeyedJaggedTensor,
+        warmup_iters: int = 3,
+    ) -> "DLRMInferenceGraph":
+        """
+        Captures DenseArch, InteractionArch and OverArch into a CUDA graph for the
+        batch size of `dense_features`. The returned DLRMInferenceGraph runs the
+        embedding lookup eagerly and replays the graph for the rest.
+
+        The pooled embeddings are B X (F * D) whatever the number of ids per feature,
+        so one graph per batch size covers all sparse inputs. The graph is kept outside
+        of the module, so copying or pickling the model is unaffected.
+
+        Args:
+            dense_features (torch.Tensor): example dense input on a CUDA device.
+            sparse_features (KeyedJaggedTensor): example sparse input.
+            warmup_iters (int): eager iterations run on a side stream before capture.
+
+        Returns:
+            DLRMInferenceGraph
+        """
+        if not dense_features.is_cuda:
+            raise ValueError("CUDA graph capture requires CUDA dense_features.")
+        with torch.no_grad():
+            embedded_sparse = self.sparse_arch(sparse_features)
+            static_dense = dense_features.clone()
+            static_sparse = KeyedTensor(
+                keys=embedded_sparse.keys(),
+                length_per_key=embedded_sparse.length_per_key(),
+                values=embedded_sparse.values().clone(),
+            )
+
+            stream = torch.cuda.Stream()
+            stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(stream):
+                for _ in range(warmup_iters):
+                    self._dense_forward(static_dense, static_sparse)
+            torch.cuda.current_stream().wait_stream(stream)
+
+            graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(graph):
+                static_logits = self._dense_forward(static_dense, static_sparse)
+
+        return DLRMInferenceGraph(
+            model=self,
+            graph=graph,
+            static_dense=static_dense,
+            static_sparse=static_sparse,
+            static_logits=static_logits,
+        )
+
+
+class DLRMInferenceGraph:
+    """
+    CUDA graph of the DenseArch, InteractionArch and OverArch of a DLRM for a single
+    batch size, created by `DLRM.capture_inference_graph`. The embedding lookup runs
+    eagerly, its pooled embeddings and the dense features are copied into the static
+    graph inputs and the graph is replayed. Other batch sizes run the model eagerly.
+
+    The graph reads the parameter storages that existed at capture time. If they are
+    replaced (e.g. by `.half()`, `.to()` or in place quantization) calls raise and the
+    graph has to be captured again. Returned logits carry no autograd history.
+
+    Call Args:
+        dense_features: torch.Tensor,
+        sparse_features: KeyedJaggedTensor,
+
+    Returns:
+        torch.Tensor - logits with size B X 1
+    """
+
+    def __init__(
+        self,
+        model: DLRM,
+        graph: "torch.cuda.CUDAGraph",
+        static_dense: torch.Tensor,
+        static_sparse: KeyedTensor,
+        static_logits: torch.Tensor,
+    ) -> None:
+        self._model = model
+        self._graph = graph
+        self._static_dense = static_dense
+        self._static_sparse = static_sparse
+        self._static_logits = static_logits
+        self._data_ptrs: List[int] = self._dense_data_ptrs()
+
+    def _dense_data_ptrs(self) -> List[int]:
+        return [
+            tensor.data_ptr()
+            for arch in (
+                self._model.dense_arch,
+                self._model.inter_arch,
+                self._model.over_arch,
+            )
+            for tensor in itertools.chain(arch.parameters(), arch.buffers())
+        ]
+
+    def __call__(
+        self,
+        dense_features: torch.Tensor,
+        sparse_features: KeyedJaggedTensor,
+    ) -> torch.Tensor:
+        if self._dense_data_ptrs() != self._data_ptrs:
+            raise RuntimeError(
+                "DLRM parameters were replaced after the CUDA graph was captured, "
+                "call capture_inference_graph again."
+            )
+        if dense_features.size(0) != self._static_dense.size(0):
+            with torch.no_grad():
+                return self._model(dense_features, sparse_features)
+
+        with torch.no_grad():
+            embedded_sparse = self._model.sparse_arch(sparse_features)
+        if embedded_sparse.keys() != self._static_sparse.keys():
+            raise ValueError(
+                f"Pooled embedding keys ({embedded_sparse.keys()}) do not match the "
+                f"captured keys ({self._static_sparse.keys()})."
+            )
+        self._static_dense.copy_(dense_features)
+        self._static_sparse.values().copy_(embedded_sparse.values())
+        self._graph.replay()
+        # the next replay overwrites static_logits in place
+        return self._static_logits.clone()
@@ -5,9 +5,11 @@
 # This source code is licensed under the BSD-style license found in the
 # LICENSE file in the root directory of this source tree.
 
+import copy
 import unittest
 from itertools import combinations
 from typing import List
+from unittest.mock import patch
 
 import torch
 from torch.testing import FileCheck  # @manual
@@ -17,6 +19,7 @@ from torchrec.models.dlrm import (
     SparseArch,
     DenseArch,
     InteractionArch,
+    OverArch,
     DLRM,
 )
 from torchrec.modules.embedding_configs import (
@@ -182,6 +185,24 @@ class DenseArchTest(unittest.TestCase):
             )
         )
 
+    def test_fuse_activation(self) -> None:
+        B = 4
+        D = 3
+        in_features = 10
+        torch.manual_seed(0)
+        dense_arch = DenseArch(in_features=in_features, layer_sizes=[10, D])
+        torch.manual_seed(0)
+        fused_dense_arch = DenseArch(
+            in_features=in_features, layer_sizes=[10, D], fuse_activation=True
+        )
+
+        features = torch.rand((B, in_features))
+        fused_dense_embedded = fused_dense_arch(features)
+        self.assertTrue(torch.equal(fused_dense_embedded, dense_arch(features)))
+
+        # in-place activation is safe under autograd
+        fused_dense_embedded.sum().backward()
+
     def test_fx_and_shape(self) -> None:
         B = 20
         D = 3
@@ -203,6 +224,33 @@ class DenseArchTest(unittest.TestCase):
         self.assertEqual(dense_embedded.size(), (B, D))
 
 
+class OverArchTest(unittest.TestCase):
+    def test_fuse_activation(self) -> None:
+        B = 4
+        in_features = 10
+        torch.manual_seed(0)
+        over_arch = OverArch(in_features=in_features, layer_sizes=[5, 3, 1])
+        torch.manual_seed(0)
+        fused_over_arch = OverArch(
+            in_features=in_features, layer_sizes=[5, 3, 1], fuse_activation=True
+        )
+
+        features = torch.rand((B, in_features))
+        logits = over_arch(features)
+        fused_logits = fused_over_arch(features)
+        self.assertEqual(fused_logits.size(), (B, 1))
+        self.assertTrue(torch.equal(fused_logits, logits))
+
+        # in-place activation is safe under autograd and yields the same gradients
+        logits.sum().backward()
+        fused_logits.sum().backward()
+        for param, fused_param in zip(
+            over_arch.parameters(), fused_over_arch.parameters()
+        ):
+            self.assertIsNotNone(fused_param.grad)
+            self.assertTrue(torch.equal(fused_param.grad, param.grad))
+
+
 class InteractionArchTest(unittest.TestCase):
     def test_basic(self) -> None:
         D = 3
@@ -222,6 +270,77 @@ class InteractionArchTest(unittest.TestCase):
         #  B X (D + F + F choose 2)
         self.assertEqual(concat_dense.size(), (B, D + F + choose(F, 2)))
 
+    def test_one_sparse(self) -> None:
+        D = 4
+        B = 6
+        keys = ["f1"]
+        inter_arch = InteractionArch(sparse_feature_names=keys)
+
+        dense_features = torch.rand((B, D))
+
+        embeddings = KeyedTensor(
+            keys=keys,
+            length_per_key=[D],
+            values=torch.rand((B, D)),
+        )
+
+        concat_dense = inter_arch(dense_features, embeddings)
+        #  B X (D + F + F choose 2)
+        self.assertEqual(concat_dense.size(), (B, D + 1))
+
+        expected = self._test_correctness_helper(
+            dense_features=dense_features,
+            sparse_features=embeddings,
+            sparse_feature_names=keys,
+        )
+        self.assertTrue(
+            torch.allclose(
+                concat_dense,
+                expected,
+                rtol=1e-4,
+                atol=1e-4,
+            )
+        )
+
+    def test_one_sparse_compute_dtype(self) -> None:
+        D = 4
+        B = 6
+        keys = ["f1"]
+        inter_arch = InteractionArch(
+            sparse_feature_names=keys, compute_dtype=torch.bfloat16
+        )
+
+        dense_features = torch.rand((B, D))
+        sparse_values = torch.rand((B, D))
+
+        embeddings = KeyedTensor(
+            keys=keys,
+            length_per_key=[D],
+            values=sparse_values,
+        )
+
+        concat_dense = inter_arch(dense_features, embeddings)
+        self.assertEqual(concat_dense.dtype, dense_features.dtype)
+
+        dot = torch.sum(
+            dense_features.to(torch.bfloat16) * sparse_values.to(torch.bfloat16),
+            dim=1,
+            keepdim=True,
+        ).to(dense_features.dtype)
+        expected = torch.cat((dense_features, dot), dim=1)
+        self.assertTrue(torch.equal(concat_dense, expected))
+
+    def test_index_buffers(self) -> None:
+        keys = ["f1", "f2", "f3"]
+        F = len(keys)
+        inter_arch = InteractionArch(sparse_feature_names=keys)
+
+        buffers = dict(inter_arch.named_buffers())
+        self.assertEqual(buffers["triu_indices"].dtype, torch.int32)
+        self.assertEqual(buffers["triu_flat"].numel(), choose(F + 1, 2))
+        # index buffers are derived from sparse_feature_names, not checkpointed
+        self.assertEqual(list(inter_arch.state_dict().keys()), [])
+
     def test_larger(self) -> None:
         D = 8
         B = 20
@@ -316,6 +435,188 @@ class InteractionArchTest(unittest.TestCase):
             )
         )
 
+    # pyre-fixme[56]: Pyre was not able to infer the type of argument
+    #  `torch.cuda.device_count() = 0` to decorator factory `unittest.skipIf`.
+    @unittest.skipIf(torch.cuda.device_count() < 1, "Need a GPU to run this test")
+    def test_device(self) -> None:
+        D = 11
+        B = 25
+        keys = ["f1", "f2", "f3", "f4", "f5", "f6"]
+        F = len(keys)
+        device = torch.device("cuda:0")
+        # the triu gather index_selects with triu_flat, which has to live on the
+        # same device as the interactions
+        inter_arch = InteractionArch(sparse_feature_names=keys, device=device)
+
+        dense_features = torch.rand((B, D), device=device)
+
+        embeddings = KeyedTensor(
+            keys=keys,
+            length_per_key=[D] * F,
+            values=torch.rand((B, D * F), device=device),
+        )
+
+        concat_dense = inter_arch(dense_features, embeddings)
+        #  B X (D + F + F choose 2)
+        self.assertEqual(concat_dense.size(), (B, D + F + choose(F, 2)))
+
+        expected = self._test_correctness_helper(
+            dense_features=dense_features,
+            sparse_features=embeddings,
+            sparse_feature_names=keys,
+        )
+        self.assertTrue(
+            torch.allclose(
+                concat_dense,
+                expected,
+                rtol=1e-4,
+                atol=1e-4,
+            )
+        )
+
+    def test_reordered_keys(self) -> None:
+        D = 5
+        B = 7
+        keys = ["f1", "f2", "f3", "f4"]
+        # e.g. the rank-grouped key order of a sharded EmbeddingBagCollection
+        kt_keys = ["f3", "f1", "f4", "f2"]
+        F = len(keys)
+        inter_arch = InteractionArch(sparse_feature_names=keys)
+        scripted_gm = torch.jit.script(symbolic_trace(inter_arch))
+
+        dense_features = torch.rand((B, D))
+
+        embeddings = KeyedTensor(
+            keys=kt_keys,
+            length_per_key=[D] * F,
+            values=torch.rand((B, D * F)),
+        )
+
+        expected = self._test_correctness_helper(
+            dense_features=dense_features,
+            sparse_features=embeddings,
+            sparse_feature_names=keys,
+        )
+        for concat_dense in (
+            inter_arch(dense_features, embeddings),
+            scripted_gm(dense_features, embeddings),
+        ):
+            #  B X (D + F + F choose 2)
+            self.assertEqual(concat_dense.size(), (B, D + F + choose(F, 2)))
+            self.assertTrue(
+                torch.allclose(
+                    concat_dense,
+                    expected,
+                    rtol=1e-4,
+                    atol=1e-4,
+                )
+            )
+
+    def test_extra_keys(self) -> None:
+        D = 5
+        B = 7
+        keys = ["f1", "f2"]
+        kt_keys = ["f1", "f3", "f2"]
+        F = len(keys)
+        inter_arch = InteractionArch(sparse_feature_names=keys)
+
+        dense_features = torch.rand((B, D))
+
+        embeddings = KeyedTensor(
+            keys=kt_keys,
+            length_per_key=[D] * len(kt_keys),
+            values=torch.rand((B, D * len(kt_keys))),
+        )
+
+        concat_dense = inter_arch(dense_features, embeddings)
+        #  B X (D + F + F choose 2)
+        self.assertEqual(concat_dense.size(), (B, D + F + choose(F, 2)))
+
+        expected = self._test_correctness_helper(
+            dense_features=dense_features,
+            sparse_features=embeddings,
+            sparse_feature_names=keys,
+        )
+        self.assertTrue(
+            torch.allclose(
+                concat_dense,
+                expected,
+                rtol=1e-4,
+                atol=1e-4,
+            )
+        )
+
+    def test_duplicate_names(self) -> None:
+        with self.assertRaises(ValueError):
+            InteractionArch(sparse_feature_names=["f1", "f2", "f1"])
+
+    # pyre-ignore[56]
+    @unittest.skipIf(
+        not hasattr(torch, "compile"),
+        "torch.compile is not available in this PyTorch build",
+    )
+    def test_torch_compile(self) -> None:
+        D = 8
+        B = 20
+        keys = ["f1", "f2", "f3", "f4"]
+        F = len(keys)
+        inter_arch = InteractionArch(sparse_feature_names=keys)
+        # pyre-ignore[16]
+        compiled_inter_arch = torch.compile(inter_arch, dynamic=False)
+
+        dense_features = torch.rand((B, D))
+
+        embeddings = KeyedTensor(
+            keys=keys,
+            length_per_key=[D] * F,
+            values=torch.rand((B, D * F)),
+        )
+
+        self.assertTrue(
+            torch.allclose(
+                compiled_inter_arch(dense_features, embeddings),
+                inter_arch(dense_features, embeddings),
+                rtol=1e-4,
+                atol=1e-4,
+            )
+        )
+
+    def test_compute_dtype(self) -> None:
+        D = 11
+        B = 25
+        keys = ["f1", "f2", "f3", "f4", "f5", "f6"]
+        F = len(keys)
+        inter_arch = InteractionArch(
+            sparse_feature_names=keys, compute_dtype=torch.bfloat16
+        )
+
+        dense_features = torch.rand((B, D))
+
+        embeddings = KeyedTensor(
+            keys=keys,
+            length_per_key=[D] * F,
+            values=torch.rand((B, D * F)),
+        )
+
+        concat_dense = inter_arch(dense_features, embeddings)
+        #  B X (D + F + F choose 2)
+        self.assertEqual(concat_dense.size(), (B, D + F + choose(F, 2)))
+        self.assertEqual(concat_dense.dtype, dense_features.dtype)
+
+        expected = self._test_correctness_helper(
+            dense_features=dense_features,
+            sparse_features=embeddings,
+            sparse_feature_names=keys,
+        )
+        self.assertTrue(
+            torch.allclose(
+                concat_dense,
+                expected,
+                rtol=1e-2,
+                atol=1e-2,
+            )
+        )
+
     def _test_correctness_helper(
         self,
         dense_features: torch.Tensor,
@@ -420,6 +721,161 @@ class DLRMTest(unittest.TestCase):
             )
         )
 
+    # pyre-fixme[56]: Pyre was not able to infer the type of argument
+    #  `torch.cuda.device_count() = 0` to decorator factory `unittest.skipIf`.
+    @unittest.skipIf(torch.cuda.device_count() < 1, "Need a GPU to run this test")
+    def test_dense_device(self) -> None:
+        B = 2
+        D = 8
+        dense_in_features = 100
+        device = torch.device("cuda:0")
+
+        eb1_config = EmbeddingBagConfig(
+            name="t1", embedding_dim=D, num_embeddings=100, feature_names=["f1", "f3"]
+        )
+        eb2_config = EmbeddingBagConfig(
+            name="t2",
+            embedding_dim=D,
+            num_embeddings=100,
+            feature_names=["f2"],
+        )
+
+        ebc = EmbeddingBagCollection(tables=[eb1_config, eb2_config], device=device)
+        # no .to(device): every dense submodule, buffers included, must be built there
+        sparse_nn = DLRM(
+            embedding_bag_collection=ebc,
+            dense_in_features=dense_in_features,
+            dense_arch_layer_sizes=[20, D],
+            over_arch_layer_sizes=[5, 1],
+            dense_device=device,
+        )
+        for buffer in sparse_nn.inter_arch.buffers():
+            self.assertEqual(buffer.device, device)
+
+        features = torch.rand((B, dense_in_features), device=device)
+        sparse_features = KeyedJaggedTensor.from_offsets_sync(
+            keys=["f1", "f3", "f2"],
+            values=torch.tensor([1, 2, 4, 5, 4, 3, 2, 9, 1, 2, 3]),
+            offsets=torch.tensor([0, 2, 4, 6, 8, 10, 11]),
+        ).to(device)
+
+        logits = sparse_nn(
+            dense_features=features,
+            sparse_features=sparse_features,
+        )
+        self.assertEqual(logits.size(), (B, 1))
+        self.assertEqual(logits.device, device)
+
+    # pyre-fixme[56]: Pyre was not able to infer the type of argument
+    #  `torch.cuda.device_count() = 0` to decorator factory `unittest.skipIf`.
+    @unittest.skipIf(torch.cuda.device_count() < 1, "Need a GPU to capture CUDA graphs")
+    def test_capture_inference_graph(self) -> None:
+        B = 2
+        D = 8
+        dense_in_features = 100
+        device = torch.device("cuda:0")
+
+        eb1_config = EmbeddingBagConfig(
+            name="t1", embedding_dim=D, num_embeddings=100, feature_names=["f1", "f3"]
+        )
+        eb2_config = EmbeddingBagConfig(
+            name="t2",
+            embedding_dim=D,
+            num_embeddings=100,
+            feature_names=["f2"],
+        )
+
+        ebc = EmbeddingBagCollection(tables=[eb1_config, eb2_config], device=device)
+        sparse_nn = DLRM(
+            embedding_bag_collection=ebc,
+            dense_in_features=dense_in_features,
+            dense_arch_layer_sizes=[20, D],
+            over_arch_layer_sizes=[5, 1],
+            dense_device=device,
+        ).eval()
+
+        sparse_features = KeyedJaggedTensor.from_offsets_sync(
+            keys=["f1", "f3", "f2"],
+            values=torch.tensor([1, 2, 4, 5, 4, 3, 2, 9, 1, 2, 3]),
+            offsets=torch.tensor([0, 2, 4, 6, 8, 10, 11]),
+        ).to(device)
+
+        graph = sparse_nn.capture_inference_graph(
+            torch.rand((B, dense_in_features), device=device), sparse_features
+        )
+
+        # different dense values and a different number of ids per feature
+        features = torch.rand((B, dense_in_features), device=device)
+        sparse_features = KeyedJaggedTensor.from_offsets_sync(
+            keys=["f1", "f3", "f2"],
+            values=torch.tensor([3, 1, 4, 1, 5, 9, 2]),
+            offsets=torch.tensor([0, 1, 2, 4, 5, 6, 7]),
+        ).to(device)
+
+        with torch.no_grad():
+            expected_logits = sparse_nn(features, sparse_features)
+
+        # the eager dense path must not run when the graph is replayed
+        with patch.object(
+            sparse_nn, "_dense_forward", side_effect=AssertionError("eager path")
+        ):
+            logits = graph(features, sparse_features)
+        self.assertEqual(logits.size(), (B, 1))
+        self.assertTrue(torch.allclose(logits, expected_logits, rtol=1e-4, atol=1e-4))
+
+        # the graph lives outside of the module, so it stays copyable
+        copy.deepcopy(sparse_nn)
+
+        # replacing the parameter storages invalidates the graph
+        sparse_nn.half()
+        with self.assertRaises(RuntimeError):
+            graph(features.half(), sparse_features)
+
+    def test_fuse_activation(self) -> None:
+        B = 2
+        D = 8
+        dense_in_features = 100
+
+        def _create_dlrm(fuse_activation: bool) -> DLRM:
+            torch.manual_seed(0)
+            eb1_config = EmbeddingBagConfig(
+                name="t1",
+                embedding_dim=D,
+                num_embeddings=100,
+                feature_names=["f1", "f3"],
+            )
+            eb2_config = EmbeddingBagConfig(
+                name="t2",
+                embedding_dim=D,
+                num_embeddings=100,
+                feature_names=["f2"],
+            )
+            ebc = EmbeddingBagCollection(tables=[eb1_config, eb2_config])
+            return DLRM(
+                embedding_bag_collection=ebc,
+                dense_in_features=dense_in_features,
+                dense_arch_layer_sizes=[20, D],
+                over_arch_layer_sizes=[5, 1],
+                fuse_activation=fuse_activation,
+            )
+
+        sparse_nn = _create_dlrm(fuse_activation=False)
+        fused_sparse_nn = _create_dlrm(fuse_activation=True)
+
+        features = torch.rand((B, dense_in_features))
+        sparse_features = KeyedJaggedTensor.from_offsets_sync(
+            keys=["f1", "f3", "f2"],
+            values=torch.tensor([1, 2, 4, 5, 4, 3, 2, 9, 1, 2, 3]),
+            offsets=torch.tensor([0, 2, 4, 6, 8, 10, 11]),
+        )
+
+        self.assertTrue(
+            torch.equal(
+                fused_sparse_nn(features, sparse_features),
+                sparse_nn(features, sparse_features),
+            )
+        )
+
     def test_one_sparse(self) -> None:
         B = 2
         D = 8